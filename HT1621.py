@@ -12,14 +12,19 @@
 #    - Enable Line:       Active Low
 
 from saleae.analyzers import HighLevelAnalyzer, AnalyzerFrame
-from enum import Enum
 
-class DECODER_STATE(Enum):
+class DECODER_STATE:
     START = 0
-    GET_MODE = 1
-    GET_ADDRESS = 2
-    GET_DATA_NIBBLES = 3
-    GET_COMMAND = 4
+    CAPTURE = 1
+
+# Field widths in bits
+MODE_BITS = 3
+ADDRESS_BITS = 6
+NIBBLE_BITS = 4
+COMMAND_BITS = 9
+
+# Nibbles decoded from one read/write transaction, later bits are ignored
+MAX_NIBBLES = 64
 
 HT1621_MODE = {
     0b110: "Read (0b110)",
@@ -92,117 +97,142 @@ HT1621_COMMAND = [
     {"name": "NORMAL",     "value": 0b111000110, "mask": 0b111111110},
 ]
 
-def lookup_command(bits):
-    for cmd in HT1621_COMMAND:
-        if (bits & cmd["mask"]) == (cmd["value"] & cmd["mask"]):
-            return cmd["name"]
+# Bits captured for every 3-bit mode value, enough for all decoded fields
+_CAPTURE_BITS = tuple(
+    MODE_BITS + COMMAND_BITS if mode == 0b100 else MODE_BITS + ADDRESS_BITS + NIBBLE_BITS * MAX_NIBBLES
+    for mode in range(8)
+)
+
+# Mode name for every 3-bit mode value
+_MODE_TABLE = tuple(HT1621_MODE.get(mode, f"Unknown Mode {mode}") for mode in range(8))
+
+# Display string for every nibble value
+_HEX = tuple(f"0x{i:x}" for i in range(16))
+
+# Display string for every 6-bit address
+_ADDRESS_HEX = tuple(f"0x{i:02x}" for i in range(64))
+
+# Frame data key for every decoded nibble
+_DATA_KEYS = tuple(f"data{i}" for i in range(MAX_NIBBLES))
+
+# HT1621_COMMAND split into parallel tuples, values pre-masked
+_CMD_NAMES = tuple(cmd["name"] for cmd in HT1621_COMMAND)
+_CMD_MASKS = tuple(cmd["mask"] for cmd in HT1621_COMMAND)
+_CMD_VALUES = tuple(cmd["value"] & cmd["mask"] for cmd in HT1621_COMMAND)
+
+def _match_command(bits):
+    for name, mask, value in zip(_CMD_NAMES, _CMD_MASKS, _CMD_VALUES):
+        if (bits & mask) == value:
+            return name
     return None
 
+# Command name for every 9-bit command value
+_CMD_TABLE = tuple(_match_command(v) for v in range(512))
+
+def lookup_command(bits):
+    return _CMD_TABLE[bits]
+
+# The consumers below take the transaction bits left after the mode, the
+# lowest rest bits of acc, and return (data, end): the frame data dict and
+# the index of the bit that completed the last field, or (None, -1)
+
+def _consume_command(acc, rest):
+    # Command mode: a single command word
+    if rest < COMMAND_BITS:
+        return None, -1
+    command = (acc >> (rest - COMMAND_BITS)) & 0x1ff
+    command_value = lookup_command(command)
+    data = {
+        'command': command_value if command_value else 'Unknown Command',
+        'command_bits': f"0b{command:09b}",
+    }
+    return data, MODE_BITS + COMMAND_BITS - 1
+
+def _consume_data(acc, rest):
+    # Read and write modes: an address followed by any number of nibbles
+    count = (rest - ADDRESS_BITS) // NIBBLE_BITS
+    if count <= 0:
+        return None, -1
+    rest -= ADDRESS_BITS
+    data = {'address': _ADDRESS_HEX[(acc >> rest) & 0x3f]}
+    nibbles = bytearray()
+    for _ in range(count):
+        rest -= NIBBLE_BITS
+        nibbles.append((acc >> rest) & 0xf)
+    data.update(zip(_DATA_KEYS, map(_HEX.__getitem__, nibbles)))
+    return data, MODE_BITS + ADDRESS_BITS + NIBBLE_BITS * count - 1
+
+# Consumer for every 3-bit mode value, anything but a command is parsed as data
+_CONSUMERS = tuple(_consume_command if mode == 0b100 else _consume_data for mode in range(8))
+
+def _decode_transaction(acc, acc_bits):
+    # Decode the MOSI bits of one transaction, shifted MSB first into the
+    # integer acc. Returns (mode, data, end), see the consumers above.
+    rest = acc_bits - MODE_BITS
+    if rest < 0:
+        return -1, None, -1
+    mode = (acc >> rest) & 0x7
+    data, end = _CONSUMERS[mode](acc, rest)
+    return mode, data, end
+
 class Hla(HighLevelAnalyzer):
+    # HighLevelAnalyzer has no __slots__, so instances keep a __dict__ for
+    # anything Logic sets on them; these just make the hot attributes faster
+    __slots__ = ('state', 'acc', 'acc_bits', 'capture_bits', 'end_times', 'append_end_time', 'transaction_start_time')
     
     def __init__(self):
         self.state = DECODER_STATE.START
-        self.mode_buffer = []
-        self.address_buffer = []
-        self.data_buffer = []
-        self.nibble_list = []
-        self.command_buffer = []
+        self.acc = 0
+        self.acc_bits = 0
+        self.capture_bits = MODE_BITS
+        self.end_times = []
+        self.append_end_time = self.end_times.append
         self.transaction_start_time = None
-        self.transaction_end_time = None
-        self.mode_type = None
-        self.command_value = None
-        self.command_bits = None
         
     def decode(self, frame: AnalyzerFrame):
-        if frame.type == 'enable':
-            self.state = DECODER_STATE.GET_MODE
-            self.mode_buffer = []
-            self.address_buffer = []
-            self.data_buffer = []
-            self.nibble_list = []
-            self.command_buffer = []
-            self.transaction_start_time = None
-            self.transaction_end_time = None
-            self.mode_type = None
-            self.command_value = None
-            self.command_bits = None
+        frame_type = frame.type
+        # 'result' frames arrive once per bit, so test for them first
+        if frame_type == 'result':
+            if self.state == DECODER_STATE.START:
+                return None
+            if self.acc_bits == self.capture_bits:
+                if self.acc_bits != MODE_BITS:
+                    # Every field that gets decoded is complete
+                    return None
+                self.capture_bits = _CAPTURE_BITS[self.acc]
+            if self.transaction_start_time is None:
+                self.transaction_start_time = frame.start_time
+            codeb = frame.data['mosi']
+            if len(codeb) != 1:
+                # Transfers over 8 bits arrive right-aligned in several bytes
+                # with no bit count, and no HT1621 transaction is a whole
+                # number of bytes, so drop the transaction rather than label
+                # padding as fields
+                self.state = DECODER_STATE.START
+                self.acc = 0
+                self.acc_bits = 0
+                self.end_times.clear()
+                return None
+            # Only the low bit is used, so Bits per Transfer must be 1
+            self.acc = (self.acc << 1) | (codeb[0] & 1)
+            self.acc_bits += 1
+            self.append_end_time(frame.end_time)
             return None
 
-        elif frame.type == 'result':
-            if self.state == DECODER_STATE.GET_MODE:
-                self.decode_mode(frame)
-            elif self.state == DECODER_STATE.GET_ADDRESS:
-                self.decode_address(frame)
-            elif self.state == DECODER_STATE.GET_DATA_NIBBLES:
-                self.decode_nibble(frame)
-            elif self.state == DECODER_STATE.GET_COMMAND:
-                self.decode_command(frame)
+        elif frame_type == 'enable':
+            self.state = DECODER_STATE.CAPTURE
+            self.acc = 0
+            self.acc_bits = 0
+            self.capture_bits = MODE_BITS
+            self.end_times.clear()
+            self.transaction_start_time = None
             return None
 
-        elif frame.type == 'disable':
-            if self.transaction_start_time is not None and self.transaction_end_time is not None and self.mode_type is not None:
-                data_dict = {}
-                if self.mode_type == 'Command (0b100)':
-                    data_dict['command'] = self.command_value if self.command_value else 'Unknown Command'
-                    data_dict['command_bits'] = f"0b{self.command_bits:09b}" if self.command_bits is not None else None
-                else:
-                    if hasattr(self, 'address_value'):
-                        data_dict['address'] = self.address_value
-                    for i, nibble in enumerate(self.nibble_list):
-                        data_dict[f'data{i}'] = f"0x{nibble:x}"
-                frame = AnalyzerFrame(self.mode_type, self.transaction_start_time, self.transaction_end_time, data_dict)
+        elif frame_type == 'disable':
+            mode, data, end = _decode_transaction(self.acc, self.acc_bits)
+            if self.transaction_start_time is not None and end >= 0:
+                frame = AnalyzerFrame(_MODE_TABLE[mode], self.transaction_start_time, self.end_times[end], data)
             else:
                 frame = None
             self.state = DECODER_STATE.START
             return frame
-
-    def decode_mode(self, frame: AnalyzerFrame):
-        if len(self.mode_buffer) == 0:
-            self.transaction_start_time = frame.start_time
-        codeb = frame.data['mosi']
-        code = codeb[0]
-        self.mode_buffer.append(code)
-        if len(self.mode_buffer) == 3:
-            mode = self.mode_buffer[0] << 2 | self.mode_buffer[1] << 1 | self.mode_buffer[2]
-            self.mode_type = HT1621_MODE.get(mode, f"Unknown Mode {mode}")
-            if mode == 0b100:
-                self.state = DECODER_STATE.GET_COMMAND
-                self.command_buffer = []
-            else:
-                self.state = DECODER_STATE.GET_ADDRESS
-                self.address_buffer = []
-
-    def decode_address(self, frame: AnalyzerFrame):
-        codeb = frame.data['mosi']
-        code = codeb[0]
-        self.address_buffer.append(code)
-        if len(self.address_buffer) == 6:
-            address = (self.address_buffer[0] << 5 | self.address_buffer[1] << 4 |
-                       self.address_buffer[2] << 3 | self.address_buffer[3] << 2 |
-                       self.address_buffer[4] << 1 | self.address_buffer[5])
-            self.address_value = f"0x{address:02x}"
-            self.state = DECODER_STATE.GET_DATA_NIBBLES
-            self.data_buffer = []
-
-    def decode_nibble(self, frame: AnalyzerFrame):
-        codeb = frame.data['mosi']
-        code = codeb[0]
-        self.data_buffer.append(code)
-        if len(self.data_buffer) == 4:
-            nibble = (self.data_buffer[0] << 3 | self.data_buffer[1] << 2 |
-                      self.data_buffer[2] << 1 | self.data_buffer[3])
-            self.nibble_list.append(nibble)
-            self.data_buffer = []
-            self.transaction_end_time = frame.end_time
-
-    def decode_command(self, frame: AnalyzerFrame):
-        codeb = frame.data['mosi']
-        code = codeb[0]
-        self.command_buffer.append(code)
-        if len(self.command_buffer) == 9:
-            bits = 0
-            for i, bit in enumerate(self.command_buffer):
-                bits |= (bit << (8 - i))
-            self.command_bits = bits
-            self.command_value = lookup_command(bits)
-            self.transaction_end_time = frame.end_time